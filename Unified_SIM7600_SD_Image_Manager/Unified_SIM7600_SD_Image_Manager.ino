@@ -32,10 +32,24 @@
  *
  * Handshake UART entre ESP32 y Raspberry Pi:
  *     Raspberry Pi → "nombre.jpg|tamaño_en_bytes\n"
+ *       (el tamaño es el del JPEG final, por eso la Pi termina de codificar
+ *        antes de transmitir; enviar mientras codifica exigiría otro encabezado)
  *     ESP32 → "READY"
- *     (bloques de datos binarios JPEG)
- *     ESP32 → "ACK" por cada bloque
+ *     (tramas <seq u16><bloque JPEG de CHUNK_SIZE bytes><crc32 u32>, little endian)
+ *     ESP32 → "ACK" por cada trama con CRC correcto (la Pi mantiene hasta
+ *             FILE_WINDOW tramas en vuelo, así que el buffer RX debe alojarlas)
+ *     ESP32 → "NAK" si el CRC falla, llega un seq adelantado/fuera de rango o
+ *             una trama queda incompleta por FRAME_GAP_MS;
+ *             luego descarta la entrada hasta RESYNC_IDLE_MS de silencio y la Pi,
+ *             tras esperar a que la línea calle, reenvía desde ese bloque
+ *     (un bloque ya escrito que llega de nuevo se confirma con "ACK" sin escribirlo)
  *     ESP32 → "DONE" al finalizar
+ *   Del lado de la Pi este protocolo vive sólo en pythonRPI/uartproto.py, que
+ *   usan todos los scripts de captura: cualquier cambio aquí va en el mismo
+ *   commit que el cambio en ese módulo.
+ *   Con FILE_SPI = 1 la Pi puede enviar "nombre|tamaño|spi\n": los datos llegan
+ *   por SPI (esclavo en HSPI) en bloques de SPI_BLOCK bytes y los "ACK" siguen
+ *   yendo por UART, después de re-armar el DMA para el siguiente bloque.
  *
  * Requisitos:
  * - Módem SIM7600 conectado vía UART (Serial1)
@@ -68,11 +82,33 @@
 #include "FS.h"
 #include "SD.h"
 #include "SPI.h"
+#include <esp_rom_crc.h>
 #define SD_CS_PIN 4
 
+// --- SPI bulk transfer (opcional; la Pi usa --spi) ---------------------------
+#define FILE_SPI 0                 // 1 = habilita el esclavo SPI para los datos de imagen
+#define FILE_SPI_HOST SPI2_HOST    // HSPI; el SD usa VSPI
+#define FILE_SPI_SCK 14
+#define FILE_SPI_MOSI 13
+#define FILE_SPI_CS 15
+#define SPI_BLOCK 4092             // debe coincidir con SPI_BLOCK en la Pi (múltiplo de 4 para DMA)
+#if FILE_SPI
+#include "driver/spi_slave.h"
+void setupSpiSlave();
+void queueSpiBlock();
+void processSpiReception();
+#endif
+
 // --- Global variables for image file --------------------
 // --- Transfer settings ---------------------------------------------------
-#define CHUNK_SIZE 1024
+#define CHUNK_SIZE 2048   // = CHUNK_SIZE en pythonRPI/uartproto.py
+#define FILE_WINDOW 4     // = WINDOW_SIZE en pythonRPI/uartproto.py (tramas en vuelo)
+#define FRAME_SEQ 2   // cada trama: <seq u16 LE><datos><crc32 u32 LE>
+#define FRAME_CRC 4   // CRC32 (compatible con zlib) sobre seq + datos
+#define FRAME_MAX (FRAME_SEQ + CHUNK_SIZE + FRAME_CRC)
+#define FILE_RX_BUFFER (FILE_WINDOW * FRAME_MAX)  // el buffer RX aloja la ventana completa
+#define RESYNC_IDLE_MS 50  // silencio en la línea tras un NAK antes de volver a parsear
+#define FRAME_GAP_MS 200   // trama a medias sin bytes nuevos: se perdieron bytes
 int RECEIVE_TIMEOUT = 45000;  // este timeoyt va a ser nas grande cuando lo intente por segunda vez solo para preubas
 unsigned long lastByteTime = 0;  // To track last received byte time
 bool sendAfterReceive = false;
@@ -82,8 +118,11 @@ File outFile;
 String filename;
 int fileSize = 0;
 int bytesReceived = 0;
+int frameReceived = 0;  // bytes de la trama actual
+uint16_t expectedSeq = 0;  // próximo bloque a escribir en SD
 String PHOTO_PATH = "";  // Ensure PHOTO_PATH is always initialized
 bool hasRetried = false;
+bool spiTransfer = false;  // encabezado terminado en "|spi": datos por SPI
 
 const char *WEBHOOK_URLOLD = "https://webhook.site/422dc1ed-dcb0-4114-9f5a-c73bf9e88423";  //pruebas exitoasas
 
@@ -93,6 +132,10 @@ int ID = 1; //debiese ser el del dispositivo completo
 #define MODEM_TX_PIN 16
 #define FILE_RX_PIN 26
 #define FILE_TX_PIN 27
+#define FILE_RTS_PIN 32            // → CTS de la Pi (GPIO16), cruzado
+#define FILE_CTS_PIN 33            // ← RTS de la Pi (GPIO17), cruzado
+#define FILE_FLOW_CONTROL 0        // 1 = RTS/CTS con la Pi (FLOW_CONTROL / --rtscts)
+#define FILE_UART_BAUD 115200      // hasta 921600 con PL011; debe coincidir con BAUD_RATE en la Pi
 // Configuración de tiempos
 #define uS_TO_S_FACTOR 1000000ULL  // Factor de conversión de microsegundos a segundos
 #define TIME_TO_SLEEP 30           // Tiempo de sleep en segundos
@@ -182,7 +225,14 @@ void readHeader() {
 
   String nameOnly = filename.substring(0, sep);
   fileSize = filename.substring(sep + 1).toInt();
-  Serial.printf("  File: %s  Size: %u bytes\n", nameOnly.c_str(), fileSize);
+  spiTransfer = filename.indexOf("|spi", sep + 1) > 0;
+  Serial.printf("  File: %s  Size: %u bytes%s\n", nameOnly.c_str(), fileSize, spiTransfer ? " (SPI)" : "");
+#if !FILE_SPI
+  if (spiTransfer) {
+    Serial.println("  ERROR: SPI transfer requested but FILE_SPI is 0");
+    return;
+  }
+#endif
   // Construyo ruta única y abro SD
   int randId = random(1, 5); //OJO este random es para pruebas sacar para version final ONLY TEST
   PHOTO_PATH = "/" + String(randId) + "_" + nameOnly + ".jpg";
@@ -194,46 +244,126 @@ void readHeader() {
 
   // Preparo variables de recepción
   bytesReceived = 0;
+  frameReceived = 0;
+  expectedSeq = 0;
   hasRetried   = false;    // reinicio antes de empezar a recibir
   lastByteTime = millis();
   receiving = true;
+#if FILE_SPI
+  if (spiTransfer) queueSpiBlock();  // el DMA debe estar armado antes de READY
+#endif
   Serial.println("  Start receiving data...");
   fileSerial.println("READY");  // <--- aviso de inicio
 }
 
 void processReception() {
+#if FILE_SPI
+  if (spiTransfer) {
+    processSpiReception();
+    return;
+  }
+#endif
+  static uint8_t frame[FRAME_MAX];
   // Mientras falten bytes…
   while (bytesReceived < fileSize) {
     if (fileSerial.available()) {
-      size_t toRead = min((size_t)fileSize - bytesReceived, (size_t)CHUNK_SIZE);
-      uint8_t buf[CHUNK_SIZE];
-      size_t n = fileSerial.read(buf, toRead);
+      // Primero el seq, que define el largo del resto de la trama
+      size_t need = FRAME_SEQ;
+      if (frameReceived >= FRAME_SEQ) need += chunkLength(frameSeq(frame)) + FRAME_CRC;
+      size_t n = fileSerial.read(frame + frameReceived, need - frameReceived);
       if (n > 0) {
-        outFile.write(buf, n);
-        bytesReceived += n;
+        frameReceived += n;
         lastByteTime = millis();
-        Serial.print(".");
-        fileSerial.println("ACK");
+        if (frameReceived == FRAME_SEQ) {
+          // seq fuera de rango o adelantado: trama corrupta o perdimos bytes
+          uint16_t seq = frameSeq(frame);
+          if (chunkLength(seq) == 0 || seq > expectedSeq) resyncReception();
+        } else if (frameReceived == FRAME_SEQ + chunkLength(frameSeq(frame)) + FRAME_CRC) {
+          handleFrame(frame);
+          frameReceived = 0;
+        }
       }
     }
 
+    // Trama incompleta y la Pi ya no envía (p. ej. perdió un byte la última): NAK
+    if (frameReceived > 0 && millis() - lastByteTime > FRAME_GAP_MS) {
+      resyncReception();
+    }
+
     // Timeout => intentamos un único reintento
     if (millis() - lastByteTime > RECEIVE_TIMEOUT) {
-      outFile.close();
-      Serial.printf("\nTIMEOUT: %u/%u bytes\n", bytesReceived, fileSize);
-      fileSerial.println("NACK_TIMEOUT");
-      receiving = false;
-      if (!hasRetried) {
-        hasRetried = true;
-        delay(3000);
-        Serial.println("Retrying reception once...");
-        fileSerial.println("foto");   // pedimos la retransmisión
-      }
+      abortReception();
       return;
     }
   }
 
-  // Ya recibimos todo
+  finishReception();
+}
+
+uint16_t frameSeq(const uint8_t *frame) {
+  return frame[0] | (frame[1] << 8);
+}
+
+// Bytes de datos del bloque `seq` (el último puede ser más corto); 0 si no existe
+size_t chunkLength(uint16_t seq) {
+  long start = (long)seq * CHUNK_SIZE;
+  if (start >= fileSize) return 0;
+  return min((long)CHUNK_SIZE, (long)fileSize - start);
+}
+
+// --- Valida una trama completa: ACK si el CRC coincide, NAK para que la Pi reenvíe ---
+void handleFrame(const uint8_t *frame) {
+  uint16_t seq = frameSeq(frame);
+  size_t len = chunkLength(seq);
+  uint32_t crc;
+  memcpy(&crc, frame + FRAME_SEQ + len, FRAME_CRC);
+  if (esp_rom_crc32_le(0, frame, FRAME_SEQ + len) != crc) {
+    resyncReception();
+    return;
+  }
+  if (seq < expectedSeq) {  // bloque ya escrito: la Pi perdió su ACK, se repite
+    fileSerial.println("ACK");
+    return;
+  }
+  outFile.write(frame + FRAME_SEQ, len);
+  bytesReceived += len;
+  expectedSeq++;
+  Serial.print(".");
+  fileSerial.println("ACK");
+}
+
+// --- Error de trama: NAK y descarta la entrada hasta que la línea quede en
+//     silencio, así el reenvío de la Pi empieza en el borde de una trama ---
+void resyncReception() {
+  Serial.print("x");
+  fileSerial.println("NAK");
+  unsigned long quietSince = millis();
+  while (millis() - quietSince < RESYNC_IDLE_MS) {
+    if (fileSerial.available()) {
+      fileSerial.read();
+      quietSince = millis();
+    }
+  }
+  frameReceived = 0;
+  lastByteTime = millis();
+}
+
+// --- Timeout: cierra el archivo y pide la foto de nuevo una sola vez ---
+void abortReception() {
+  outFile.close();
+  Serial.printf("\nTIMEOUT: %u/%u bytes\n", bytesReceived, fileSize);
+  fileSerial.println("NACK_TIMEOUT");
+  receiving = false;
+  if (!hasRetried) {
+    hasRetried = true;
+    delay(3000);
+    Serial.println("Retrying reception once...");
+    fileSerial.println("foto");   // pedimos la retransmisión
+  }
+}
+
+// --- Recepción completa ---
+void finishReception() {
   outFile.close();
   Serial.println("\nFile saved: " + PHOTO_PATH);
   fileSerial.println("DONE");
@@ -242,6 +372,55 @@ void processReception() {
   // NO reiniciamos hasRetried aquí; el próximo header hará reset.
 }
 
+#if FILE_SPI
+WORD_ALIGNED_ATTR uint8_t spiBuf[SPI_BLOCK];  // buffer DMA
+spi_slave_transaction_t spiTrans;
+
+void setupSpiSlave() {
+  spi_bus_config_t bus = {};
+  bus.mosi_io_num = FILE_SPI_MOSI;
+  bus.miso_io_num = -1;            // sólo recibimos
+  bus.sclk_io_num = FILE_SPI_SCK;
+  bus.quadwp_io_num = -1;
+  bus.quadhd_io_num = -1;
+  bus.max_transfer_sz = SPI_BLOCK;
+  spi_slave_interface_config_t slv = {};
+  slv.spics_io_num = FILE_SPI_CS;
+  slv.queue_size = 1;
+  slv.mode = 0;
+  if (spi_slave_initialize(FILE_SPI_HOST, &bus, &slv, SPI_DMA_CH_AUTO) != ESP_OK) {
+    Serial.println("SPI slave init failed");
+  }
+}
+
+// Arma el DMA para el próximo bloque; la Pi sólo transmite tras READY/ACK
+void queueSpiBlock() {
+  memset(&spiTrans, 0, sizeof(spiTrans));
+  spiTrans.length = SPI_BLOCK * 8;
+  spiTrans.rx_buffer = spiBuf;
+  spi_slave_queue_trans(FILE_SPI_HOST, &spiTrans, portMAX_DELAY);
+}
+
+void processSpiReception() {
+  spi_slave_transaction_t *done;
+  if (spi_slave_get_trans_result(FILE_SPI_HOST, &done, pdMS_TO_TICKS(100)) == ESP_OK) {
+    size_t n = min((size_t)(fileSize - bytesReceived), (size_t)(done->trans_len / 8));
+    outFile.write(spiBuf, n);
+    bytesReceived += n;
+    lastByteTime = millis();
+    if (bytesReceived < fileSize) queueSpiBlock();
+    Serial.print(".");
+    fileSerial.println("ACK");
+    if (bytesReceived >= fileSize) finishReception();
+  } else if (millis() - lastByteTime > RECEIVE_TIMEOUT) {
+    // La transacción pendiente no se puede cancelar: reinicio el driver
+    spi_slave_free(FILE_SPI_HOST);
+    setupSpiSlave();
+    abortReception();
+  }
+}
+#endif
+
 // --- Hardware initialization --------------------------------------------
 void setupHardware() {
   // USB-Serial and AT-Serial
@@ -249,7 +428,15 @@ void setupHardware() {
   modem.restart();
   modem.init();
   // File-transfer serial
-  fileSerial.begin(UART_BAUD, SERIAL_8N1, FILE_RX_PIN, FILE_TX_PIN);
+  fileSerial.setRxBufferSize(FILE_RX_BUFFER);
+  fileSerial.begin(FILE_UART_BAUD, SERIAL_8N1, FILE_RX_PIN, FILE_TX_PIN);
+#if FILE_FLOW_CONTROL
+  fileSerial.setPins(FILE_RX_PIN, FILE_TX_PIN, FILE_CTS_PIN, FILE_RTS_PIN);
+  fileSerial.setHwFlowCtrlMode(UART_HW_FLOWCTRL_CTS_RTS, 64);
+#endif
+#if FILE_SPI
+  setupSpiSlave();
+#endif
 
   // OLED
   display.begin();
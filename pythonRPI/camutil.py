@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Capture helpers
+---------------
+Camera-side helpers shared by the capture scripts (serialfotomejorada.py,
+serialfotoguardachunks.py, sfv2.py): capture ids, the JPEG encoder, the
+background archive writer, and sizing / converting the ISP-scaled lores stream.
+"""
+import itertools
+import numpy as np
+import cv2
+from datetime import datetime
+from jpegenc import JpegEncoder
+from concurrent.futures import ThreadPoolExecutor
+
+# libjpeg-turbo encoder (SIMD); keeps one compressor handle per thread across captures
+tj = JpegEncoder()
+
+# Background writer for full-res archives (overlaps disk I/O with UART send)
+archive_pool = ThreadPoolExecutor(max_workers=1)
+
+# Sequence number appended to capture timestamps (unique within one second)
+_seq = itertools.count()
+
+
+def capture_id() -> str:
+    """Return a unique per-capture id: timestamp plus a process-wide sequence number."""
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{next(_seq):04d}"
+
+
+def archive(func, *args) -> None:
+    """Run func(*args) on the archive thread and report any exception it raises."""
+    archive_pool.submit(func, *args).add_done_callback(_report_archive_error)
+
+
+def _report_archive_error(future) -> None:
+    """Done-callback for archive jobs: print the error instead of dropping it."""
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Error: background save failed: {future.exception()!r}")
+
+
+def lores_size(sensor_res, width: int) -> (int, int):
+    """Size of the ISP-scaled lores stream for `width`, keeping the sensor aspect (even sides for YUV420)."""
+    w, h = sensor_res
+    return width & ~1, max(2, int(width * h / w) & ~1)
+
+
+def lores_rgb(lores: np.ndarray, stream: dict) -> np.ndarray:
+    """
+    Convert a YUV420 lores array to RGB. Picamera2 returns the planes with their
+    row stride, so any padding past the image width is dropped first.
+    """
+    w, h = stream["size"]
+    stride = stream["stride"]
+    if stride != w:
+        flat = lores.reshape(-1)
+        y_end = stride * h
+        c_len = (stride // 2) * (h // 2)
+        y = flat[:y_end].reshape(h, stride)[:, :w]
+        u = flat[y_end:y_end + c_len].reshape(h // 2, stride // 2)[:, :w // 2]
+        v = flat[y_end + c_len:y_end + 2 * c_len].reshape(h // 2, stride // 2)[:, :w // 2]
+        lores = np.concatenate((y.ravel(), u.ravel(), v.ravel())).reshape(h * 3 // 2, w)
+    return cv2.cvtColor(lores, cv2.COLOR_YUV2RGB_I420)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Persistent libjpeg-turbo encoder
+--------------------------------
+PyTurboJPEG's TurboJPEG.encode() creates and destroys a compressor handle
+(jpeg_compress_struct and its memory pools) on every call. JpegEncoder keeps
+one handle per thread and reuses it for every shot, calling libturbojpeg's
+tjCompress2 directly through ctypes. The output buffer is allocated by
+libjpeg-turbo at the size the JPEG actually needs and freed after each call.
+
+encode() takes the same arguments as TurboJPEG.encode(); the TJPF_* / TJSAMP_*
+constants it accepts are defined here, so only libturbojpeg itself is needed.
+"""
+import ctypes
+import ctypes.util
+import threading
+import numpy as np
+
+# Pixel formats (TJPF) and chroma subsampling (TJSAMP) from turbojpeg.h
+TJPF_RGB          = 0
+TJPF_BGR          = 1
+TJPF_GRAY         = 6
+TJSAMP_444        = 0
+TJSAMP_422        = 1
+TJSAMP_420        = 2
+TJSAMP_GRAY       = 3
+
+# Bytes per pixel for each TJPF value (tjPixelSize in turbojpeg.h)
+tjPixelSize = (3, 3, 4, 4, 4, 4, 1, 4, 4, 4, 4, 4)
+
+_ubyte_p = ctypes.POINTER(ctypes.c_ubyte)
+
+
+class JpegEncoder:
+    """JPEG encoder that reuses a libturbojpeg compressor handle per thread."""
+
+    def __init__(self, lib_path: str = None):
+        path = lib_path or ctypes.util.find_library('turbojpeg') or 'libturbojpeg.so.0'
+        lib = ctypes.CDLL(path)
+        lib.tjInitCompress.restype = ctypes.c_void_p
+        lib.tjInitCompress.argtypes = []
+        lib.tjCompress2.restype = ctypes.c_int
+        lib.tjCompress2.argtypes = [
+            ctypes.c_void_p, _ubyte_p, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+            ctypes.c_int, ctypes.POINTER(_ubyte_p), ctypes.POINTER(ctypes.c_ulong),
+            ctypes.c_int, ctypes.c_int, ctypes.c_int]
+        lib.tjFree.restype = None
+        lib.tjFree.argtypes = [_ubyte_p]
+        lib.tjGetErrorStr2.restype = ctypes.c_char_p
+        lib.tjGetErrorStr2.argtypes = [ctypes.c_void_p]
+        self._lib = lib
+        self._local = threading.local()
+
+    def _handle(self):
+        """Return this thread's compressor handle, creating it on first use."""
+        local = self._local
+        if not hasattr(local, 'handle'):
+            handle = self._lib.tjInitCompress()
+            if not handle:
+                raise IOError("tjInitCompress failed")
+            local.handle = handle
+        return local.handle
+
+    def encode(self, img_array: np.ndarray, quality: int = 85, pixel_format: int = TJPF_BGR,
+               jpeg_subsample: int = TJSAMP_422, flags: int = 0) -> bytes:
+        """Encode an 8-bit image array (H×W×C) to JPEG bytes."""
+        if img_array.dtype != np.uint8:
+            raise ValueError(f"Invalid dtype for image data: {img_array.dtype} (expected uint8)")
+        channels = tjPixelSize[pixel_format]
+        if (img_array.ndim != 3 or img_array.shape[2] != channels) and \
+                not (channels == 1 and img_array.ndim == 2):
+            raise ValueError(f"Invalid shape for image data: {img_array.shape} "
+                             f"({channels} channel(s) expected)")
+        img = np.ascontiguousarray(img_array)
+        height, width = img.shape[:2]
+        handle = self._handle()
+
+        # NULL buffer: libjpeg-turbo grows its own output buffer as needed
+        buf = _ubyte_p()
+        size = ctypes.c_ulong(0)
+        status = self._lib.tjCompress2(
+            handle, img.ctypes.data_as(_ubyte_p), width, img.strides[0], height,
+            pixel_format, ctypes.byref(buf), ctypes.byref(size),
+            jpeg_subsample, quality, flags)
+        try:
+            if status != 0:
+                raise IOError(self._lib.tjGetErrorStr2(handle).decode(errors='ignore'))
+            return ctypes.string_at(buf, size.value)
+        finally:
+            if buf:
+                self._lib.tjFree(buf)
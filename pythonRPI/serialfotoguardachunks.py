@@ -2,19 +2,22 @@
 import serial
 import time
 import os
-import io
+import atexit
 from picamera2 import Picamera2
-from PIL import Image
-from datetime import datetime
+import numpy as np
+import cv2
+from camutil import archive, capture_id, tj, lores_size, lores_rgb
+from jpegenc import TJPF_RGB, TJPF_GRAY, TJSAMP_420, TJSAMP_GRAY
+from uartproto import enable_low_latency, read_line, send_data_via_serial
 
 # --- Configuration --------------------------------------------------------
 SERIAL_PORT        = '/dev/ttyAMA0'
-BAUD_RATE          = 115200
+BAUD_RATE          = 115200   # PL011 supports up to 921600; ESP32 FILE_UART_BAUD must match
+FLOW_CONTROL       = False    # RTS/CTS on GPIO16/17; ESP32 FILE_FLOW_CONTROL must match
 FULLRES_DIR        = 'fullres'
 DEFAULT_WIDTH      = 1024     # max width of resized image (px)
 DEFAULT_QUALITY    = 5        # 1–10 scale => JPEG quality 10–100
-ACK_TIMEOUT        = 10       # seconds to wait for each handshake
-CHUNK_SIZE         = 256      # bytes per chunk
+GRAYSCALE_MAX      = 3        # quality scales up to this are sent as grayscale
 
 # Ensure full-resolution directory exists
 os.makedirs(FULLRES_DIR, exist_ok=True)
@@ -35,109 +38,83 @@ def unique_filename(base: str, ext: str, folder: str = None) -> str:
         path = os.path.join(folder, f"{name}.{ext}") if folder else f"{name}.{ext}"
     return path
 
-def capture_and_prepare(width: int, quality_scale: int):
+def save_jpeg(arr: np.ndarray, path: str, quality: int = 95) -> None:
+    """Encode an RGB array to JPEG and write it to `path`."""
+    with open(path, 'wb') as f:
+        f.write(tj.encode(arr, quality=quality, pixel_format=TJPF_RGB))
+    print(f"Saved full-res: {path}")
+
+def capture_and_prepare(picam2: Picamera2, width: int, quality_scale: int):
     """
-    Capture full-res image, save to disk, then prepare resized JPEG in memory.
+    Capture full-res image in memory from the already-running camera, save it to disk in the background,
+    then prepare resized JPEG in memory.
     Returns tuple (fullres_path, resized_bytes).
     """
     # Map quality_scale (1-10) to JPEG quality (10-100)
     jpeg_quality = max(1, min(quality_scale, 10)) * 10
 
-    # Initialize camera
-    picam2 = Picamera2()
-    sensor_res = picam2.sensor_resolution
-    config = picam2.create_still_configuration(main={"size": sensor_res})
-    picam2.configure(config)
-    picam2.start()
-    time.sleep(2)  # allow sensor to warm up
-
     # Timestamp for filename
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    timestamp = capture_id()
     base_name = f"image_{timestamp}_fullres"
     fullres_path = unique_filename(base_name, "jpg", folder=FULLRES_DIR)
     
-    # Capture and save full-resolution
-    picam2.capture_file(fullres_path)
-    picam2.close()
+    # Capture full-resolution RGB and ISP-scaled lores YUV from the same frame;
+    # archive the full-res asynchronously
+    (arr, lores), _ = picam2.capture_arrays(["main", "lores"])
+    archive(save_jpeg, arr, fullres_path)
     print(f"Captured full-res: {fullres_path}")
 
-    # Open and resize in memory
-    img = Image.open(fullres_path)
-    aspect = img.width / img.height if img.height else 1
-    new_height = int(width / aspect)
-    resized_img = img.resize((width, new_height), Image.LANCZOS)
-
-    # Serialize JPEG into bytes buffer
-    buffer = io.BytesIO()
-    resized_img.save(buffer, format='JPEG', quality=jpeg_quality, optimize=True)
-    data = buffer.getvalue()
+    # The ISP already scaled the default width (if libcamera kept the requested
+    # size); other widths are resized in memory
+    cfg = picam2.camera_config
+    if tuple(cfg["lores"]["size"]) == lores_size(cfg["main"]["size"], width):
+        resized = lores_rgb(lores, cfg["lores"])
+        new_height = resized.shape[0]
+    else:
+        h, w = arr.shape[:2]
+        aspect = w / h if h else 1
+        new_height = int(width / aspect)
+        resized = cv2.resize(arr, (width, new_height), interpolation=cv2.INTER_LANCZOS4)
+
+    # Encode JPEG into bytes with libjpeg-turbo; low quality drops chroma entirely
+    if jpeg_quality <= GRAYSCALE_MAX * 10:
+        gray = cv2.cvtColor(resized, cv2.COLOR_RGB2GRAY)
+        data = tj.encode(gray[..., None], quality=jpeg_quality,
+                         pixel_format=TJPF_GRAY, jpeg_subsample=TJSAMP_GRAY)
+    else:
+        data = tj.encode(resized, quality=jpeg_quality,
+                         pixel_format=TJPF_RGB, jpeg_subsample=TJSAMP_420)
     print(f"Prepared resized image: {width}×{new_height}, quality={jpeg_quality}, {len(data)} bytes")
 
     return fullres_path, data
 
-def wait_for(ser: serial.Serial, expected: str, timeout: int) -> bool:
-    """
-    Block until `expected` line appears on serial or timeout expires.
-    Lines are stripped of whitespace.
-    """
-    deadline = time.time() + timeout
-    while time.time() < deadline:
-        line = ser.readline().decode(errors='ignore').strip()
-        if line == expected:
-            return True
-    return False
-
-def send_data_via_serial(ser: serial.Serial, data: bytes, dest_name: str) -> bool:
-    """
-    Send header and then data in chunks, performing handshakes:
-      - Header: "<dest_name>|<len_bytes>\\n", expect "READY"
-      - For each chunk: send block, expect "ACK"
-      - After all: expect "DONE"
-    Returns True on success.
-    """
-    total_len = len(data)
-    header = f"{dest_name}|{total_len}\n"
-    ser.write(header.encode())
-    print(f"Sent header: '{header.strip()}'")
-
-    # Wait for READY
-    if not wait_for(ser, "READY", ACK_TIMEOUT):
-        print("Error: no READY response from ESP32")
-        return False
-
-    # Send in chunks
-    offset = 0
-    while offset < total_len:
-        end = min(offset + CHUNK_SIZE, total_len)
-        ser.write(data[offset:end])
-        if not wait_for(ser, "ACK", ACK_TIMEOUT):
-            print(f"Error: no ACK for chunk starting at {offset}")
-            return False
-        offset = end
-        print(f"Sent {offset}/{total_len} bytes")
-
-    # Wait for final DONE
-    if not wait_for(ser, "DONE", ACK_TIMEOUT):
-        print("Error: no DONE response (incomplete transfer)")
-        return False
-
-    print("Transfer completed successfully")
-    return True
-
 # --- Main Loop -----------------------------------------------------------
 
 def main():
     # Open serial port
-    ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
+    ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1, rtscts=FLOW_CONTROL)
+    enable_low_latency(ser)
+
+    # Initialize camera once; it stays running between commands
+    picam2 = Picamera2()
+    sensor_res = picam2.sensor_resolution
+    config = picam2.create_still_configuration(
+        main={"size": sensor_res},
+        lores={"size": lores_size(sensor_res, DEFAULT_WIDTH), "format": "YUV420"})
+    picam2.configure(config)
+    picam2.start()
+    atexit.register(picam2.close)
+    time.sleep(2)  # allow sensor to warm up
+
     print("Ready. Waiting for 'foto' commands...")
 
     while True:
-        line = ser.readline().decode(errors='ignore').strip()
+        line = read_line(ser)
         if not line:
             continue
 
-        parts = line.split()
-        if parts[0].lower() != 'foto':
+        parts = line.decode(errors='ignore').split()
+        if not parts or parts[0].lower() != 'foto':
             continue
 
         # Parse optional width and quality
@@ -157,7 +134,7 @@ def main():
         print(f"Command: foto → width={width}, quality={quality}")
 
         # Capture and prepare images
-        fullres_path, resized_bytes = capture_and_prepare(width, quality)
+        fullres_path, resized_bytes = capture_and_prepare(picam2, width, quality)
         unix_ts = str(int(time.time()))
 
         # Send resized data
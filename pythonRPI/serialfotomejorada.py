@@ -5,15 +5,16 @@ Image Transfer Pipeline for Raspberry Pi & ESP32
 This script listens on a UART interface for a 'foto' command from an ESP32 module.
 When invoked, it performs the following steps:
 
-1. Capture a raw full-resolution image using the Pi Camera.
-2. Enhance the image by applying:
-   - Unsharp Mask for sharpening.
-   - CLAHE (Contrast Limited Adaptive Histogram Equalization) for local contrast.
-3. Save both the raw and enhanced full-resolution images to disk.
-4. Resize the enhanced image to a configurable width.
+1. Capture a full-resolution image using the Pi Camera; sharpening and global
+   contrast are applied by the ISP through camera controls.
+2. Take the transfer-size image from the ISP's lores stream (no CPU resize).
+3. Enhance the resized image with CLAHE (Contrast Limited Adaptive Histogram
+   Equalization) for local contrast.
+4. Save both the raw full-resolution and the enhanced resized images to disk.
 5. Send the resized image over UART in fixed-size chunks with a handshake protocol:
    - SEND header "<filename>|<size>\n", wait for "READY"
-   - Transmit each chunk, wait for "ACK"
+   - Transmit CRC32-framed chunks with up to WINDOW_SIZE awaiting "ACK" at once
+     ("NAK" on a CRC mismatch resends from that chunk)
    - After all chunks, wait for "DONE"
 6. The ESP32 saves the incoming data as a JPEG file.
 
@@ -24,27 +25,32 @@ Usage:
 import serial
 import time
 import os
-import io
+import atexit
 from picamera2 import Picamera2
-from PIL import Image, ImageFilter
 import numpy as np
 import cv2
-from datetime import datetime
+from camutil import archive, capture_id, tj, lores_size, lores_rgb
+from jpegenc import TJPF_RGB, TJSAMP_420
+from uartproto import enable_low_latency, read_line, send_data_via_serial
 
 # --- Configuration --------------------------------------------------------
 SERIAL_PORT        = '/dev/ttyAMA0'
-BAUD_RATE          = 115200
+BAUD_RATE          = 115200   # PL011 supports up to 921600; ESP32 FILE_UART_BAUD must match
+FLOW_CONTROL       = False    # RTS/CTS on GPIO16/17; ESP32 FILE_FLOW_CONTROL must match
 RAW_DIR            = 'fullres'
 ENHANCED_DIR       = 'enhanced'
 DEFAULT_WIDTH      = 1024     # resized max width (px)
 DEFAULT_QUALITY    = 5        # 1–10 scale → JPEG quality 10–100
-ACK_TIMEOUT        = 10       # seconds to wait per handshake
-CHUNK_SIZE         = 256      # bytes per chunk
+ISP_CONTROLS       = {"Sharpness": 1.5, "Contrast": 1.2, "AeEnable": True, "AwbEnable": True}
+TUNING_FILE        = None     # e.g. "imx477.json" to load a custom ISP tuning
 
 # Ensure directories exist
 os.makedirs(RAW_DIR, exist_ok=True)
 os.makedirs(ENHANCED_DIR, exist_ok=True)
 
+# CLAHE operator, built once and reused for every frame
+clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
+
 # --- Utility Functions ---------------------------------------------------
 
 def unique_filename(base: str, ext: str, folder: str) -> str:
@@ -57,116 +63,78 @@ def unique_filename(base: str, ext: str, folder: str) -> str:
     return path
 
 
-def wait_for(ser: serial.Serial, expected: str, timeout: int) -> bool:
-    """Block until `expected` line arrives on serial or timeout."""
-    deadline = time.time() + timeout
-    while time.time() < deadline:
-        line = ser.readline().decode(errors='ignore').strip()
-        if line == expected:
-            return True
-    return False
-
-
-def send_data_via_serial(ser: serial.Serial, data: bytes, dest_name: str) -> bool:
-    """
-    Send header and data in chunks with handshakes:
-      - Header: "<dest_name>|<len>\n" → expect "READY"
-      - Each chunk → expect "ACK"
-      - Final → expect "DONE"
-    """
-    total_len = len(data)
-    header = f"{dest_name}|{total_len}\n"
-    ser.write(header.encode())
-    print(f"Sent header: '{header.strip()}'")
-
-    if not wait_for(ser, "READY", ACK_TIMEOUT):
-        print("Error: no READY from ESP32")
-        return False
-
-    sent = 0
-    while sent < total_len:
-        end = min(sent + CHUNK_SIZE, total_len)
-        ser.write(data[sent:end])
-        if not wait_for(ser, "ACK", ACK_TIMEOUT):
-            print(f"Error: no ACK for chunk at {sent}")
-            return False
-        sent = end
-        print(f"Sent {sent}/{total_len} bytes")
-
-    if not wait_for(ser, "DONE", ACK_TIMEOUT):
-        print("Error: no DONE from ESP32")
-        return False
-
-    print("Transfer completed successfully")
-    return True
+def save_jpeg(arr: np.ndarray, path: str, quality: int = 95) -> None:
+    """Encode an RGB array to JPEG and write it to `path`."""
+    with open(path, 'wb') as f:
+        f.write(tj.encode(arr, quality=quality, pixel_format=TJPF_RGB))
+    print(f"Saved image: {path}")
 
-# --- Image Processing Functions ------------------------------------------
 
-def capture_raw_image() -> str:
-    """Capture and save a raw full-resolution JPEG. Returns filepath."""
-    picam2 = Picamera2()
-    cfg = picam2.create_still_configuration(main={"size": picam2.sensor_resolution})
-    picam2.configure(cfg)
-    picam2.start()
-    time.sleep(2)
+# --- Image Processing Functions ------------------------------------------
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+def capture_raw_image(picam2: Picamera2, timestamp: str) -> (np.ndarray, str):
+    """Capture a frame, archive the full-res RGB in the background. Returns (ISP-scaled RGB array, filepath)."""
     base = f"{timestamp}_raw"
     path = unique_filename(base, "jpg", RAW_DIR)
-    picam2.capture_file(path)
-    picam2.close()
-    print(f"Saved raw image: {path}")
-    return path
+    (arr, lores), _ = picam2.capture_arrays(["main", "lores"])
+    archive(save_jpeg, arr, path)
+    print(f"Captured raw image: {path}")
+    return lores_rgb(lores, picam2.camera_config["lores"]), path
 
 
-def enhance_image(raw_path: str) -> (Image.Image, str):
-    """Load raw image, apply unsharp mask and CLAHE, save enhanced full-res, return PIL and path."""
-    img = Image.open(raw_path)
-    # Unsharp Mask
-    img = img.filter(ImageFilter.UnsharpMask(radius=1.5, percent=150, threshold=3))
-    # CLAHE
-    arr = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-    lab = cv2.cvtColor(arr, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab)
-    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-    cl = clahe.apply(l)
-    merged = cv2.merge((cl, a, b))
-    rgb = cv2.cvtColor(merged, cv2.COLOR_LAB2RGB)
-    enhanced = Image.fromarray(rgb)
-
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+def enhance_image(img: np.ndarray, timestamp: str) -> (np.ndarray, str):
+    """Apply CLAHE to a resized RGB frame, save it in the background, return RGB array and path."""
+    # CLAHE on the L channel only, straight from RGB and written back in place
+    lab = cv2.cvtColor(img, cv2.COLOR_RGB2LAB)
+    cv2.insertChannel(clahe.apply(cv2.extractChannel(lab, 0)), lab, 0)
+    rgb = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+
     base = f"{timestamp}_en"
     path = unique_filename(base, "jpg", ENHANCED_DIR)
-    enhanced.save(path, format='JPEG', quality=95, optimize=True)
-    print(f"Saved enhanced image: {path}")
-    return enhanced, path
+    archive(save_jpeg, rgb, path)
+    return rgb, path
 
 # --- Main Loop -----------------------------------------------------------
 
 def main():
-    ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
+    ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1, rtscts=FLOW_CONTROL)
+    enable_low_latency(ser)
+
+    # Initialize camera once; it stays running between commands.
+    # Sharpening and contrast are done by the ISP instead of in OpenCV.
+    if TUNING_FILE:
+        picam2 = Picamera2(tuning=Picamera2.load_tuning_file(TUNING_FILE))
+    else:
+        picam2 = Picamera2()
+    sensor_res = picam2.sensor_resolution
+    cfg = picam2.create_still_configuration(
+        main={"size": sensor_res},
+        lores={"size": lores_size(sensor_res, DEFAULT_WIDTH), "format": "YUV420"},
+        controls=ISP_CONTROLS)
+    picam2.configure(cfg)
+    picam2.start()
+    atexit.register(picam2.close)
+    time.sleep(2)
+
     print("Ready. Awaiting 'foto' command...")
 
     while True:
-        line = ser.readline().decode(errors='ignore').strip()
+        line = read_line(ser)
         if not line:
             continue
-        parts = line.split()
-        if parts[0].lower() != 'foto':
+        parts = line.decode(errors='ignore').split()
+        if not parts or parts[0].lower() != 'foto':
             continue
 
         print("Received 'foto' command")
-        raw_path = capture_raw_image()
-        enhanced_img, enhanced_path = enhance_image(raw_path)
-
-        # Resize for transfer
-        aspect = enhanced_img.width / enhanced_img.height if enhanced_img.height else 1
-        new_height = int(DEFAULT_WIDTH / aspect)
-        resized = enhanced_img.resize((DEFAULT_WIDTH, new_height), Image.LANCZOS)
-        buf = io.BytesIO()
+        timestamp = capture_id()
+        resized, _ = capture_raw_image(picam2, timestamp)
+
+        # Enhance at the reduced size
+        enhanced, enhanced_path = enhance_image(resized, timestamp)
         jpeg_quality = max(1, min(DEFAULT_QUALITY, 10)) * 10
-        resized.save(buf, format='JPEG', quality=jpeg_quality, optimize=True)
-        data = buf.getvalue()
+        data = tj.encode(enhanced, quality=jpeg_quality,
+                         pixel_format=TJPF_RGB, jpeg_subsample=TJSAMP_420)
 
         # Send over serial
         dest_name = os.path.splitext(os.path.basename(enhanced_path))[0]
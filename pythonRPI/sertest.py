@@ -1,57 +1,64 @@
 import serial
-import threading
+import select
 import sys
+import os
 import glob
+import argparse
 
 BAUD_RATE = 115200
+PORT_PATTERNS = ('/dev/ttyS*', '/dev/ttyAMA*', '/dev/serial*', '/dev/ttyUSB*')
 
-# Buscar puertos serie disponibles
-serial_ports = glob.glob('/dev/ttyS*') + glob.glob('/dev/ttyAMA*') + glob.glob('/dev/serial*') + glob.glob('/dev/ttyUSB*')
-print("Puertos serie encontrados:", serial_ports)
+parser = argparse.ArgumentParser(description='Interactive serial terminal')
+parser.add_argument('--port', help='Serial port override', default=None)
+parser.add_argument('--baud', help='Baud rate', type=int, default=BAUD_RATE)
+args = parser.parse_args()
 
-if not serial_ports:
-    print("No se encontrÃ³ ningÃºn puerto serie disponible.")
-    sys.exit(1)
+if args.port:
+    SERIAL_PORT = args.port
+else:
+    # Buscar puertos serie disponibles
+    serial_ports = [port for pattern in PORT_PATTERNS for port in glob.glob(pattern)]
+    print("Puertos serie encontrados:", serial_ports)
+
+    if not serial_ports:
+        print("No se encontró ningún puerto serie disponible.")
+        sys.exit(1)
 
-SERIAL_PORT = serial_ports[0]  # Selecciona el primero encontrado
+    SERIAL_PORT = serial_ports[0]  # Selecciona el primero encontrado
 print(f"Usando puerto serie: {SERIAL_PORT}")
 
 def read_serial(ser):
-    while True:
-        if ser.in_waiting > 0:
-            data = ser.read(ser.in_waiting)
-            try:
-                print(data.decode(errors='replace'), end='')
-            except:
-                print(data)
+    """Copy whatever is waiting on the serial port to stdout. Returns False on hangup."""
+    data = os.read(ser.fileno(), 4096)
+    if not data:
+        return False
+    sys.stdout.buffer.write(data)
+    sys.stdout.flush()
+    return True
 
 def write_serial(ser):
-    while True:
-        try:
-            line = sys.stdin.readline()
-            if not line:
-                break
-            ser.write(line.encode())
-        except KeyboardInterrupt:
-            break
+    """Copy whatever is waiting on stdin to the serial port. Returns False on EOF."""
+    data = os.read(sys.stdin.fileno(), 4096)
+    if not data:
+        return False
+    ser.write(data)
+    return True
 
 try:
-    ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
-    print(f"Opened {SERIAL_PORT} at {BAUD_RATE} bps.")
+    ser = serial.Serial(SERIAL_PORT, args.baud, timeout=1)
+    print(f"Opened {SERIAL_PORT} at {args.baud} bps.")
 except Exception as e:
     print(f"Could not open the port: {e}")
     sys.exit(1)
 
-read_thread = threading.Thread(target=read_serial, args=(ser,), daemon=True)
-read_thread.start()
-
+# Single event loop: block in the kernel until the port or stdin has data
 try:
-    write_serial(ser)
-except KeyboardInterrupt:
-    print("\nExiting program.")
-finally:
-    ser.close()
-
+    while True:
+        ready, _, _ = select.select([ser.fileno(), sys.stdin], [], [])
+        if ser.fileno() in ready and not read_serial(ser):
+            break
+        if sys.stdin in ready and not write_serial(ser):
+            break
 except KeyboardInterrupt:
     print("\nExiting program.")
 finally:
@@ -13,7 +13,8 @@ When invoked, it performs the following steps:
 4. Resize the enhanced image to a configurable width.
 5. Send the resized image over UART in fixed-size chunks with a handshake protocol:
    - SEND header "<filename>|<size>\n", wait for "READY"
-   - Transmit each chunk, wait for "ACK"
+   - Transmit CRC32-framed chunks with up to WINDOW_SIZE awaiting "ACK" at once
+     ("NAK" on a CRC mismatch resends from that chunk)
    - After all chunks, wait for "DONE"
 6. The ESP32 saves the incoming data as a JPEG file.
 
@@ -29,6 +30,7 @@ from picamera2 import Picamera2
 from PIL import Image, ImageFilter
 import numpy as np
 import cv2
+from uartproto import read_line, send_data_via_serial
 from datetime import datetime
 
 # --- Configuration --------------------------------------------------------
@@ -38,8 +40,6 @@ RAW_DIR            = 'fullres'
 ENHANCED_DIR       = 'enhanced'
 DEFAULT_WIDTH      = 1024     # resized max width (px)
 DEFAULT_QUALITY    = 5        # 1–10 scale → JPEG quality 10–100
-ACK_TIMEOUT        = 10       # seconds to wait per handshake
-CHUNK_SIZE         = 256      # bytes per chunk
 
 # Ensure directories exist
 os.makedirs(RAW_DIR, exist_ok=True)
@@ -57,49 +57,6 @@ def unique_filename(base: str, ext: str, folder: str) -> str:
     return path
 
 
-def wait_for(ser: serial.Serial, expected: str, timeout: int) -> bool:
-    """Block until `expected` line arrives on serial or timeout."""
-    deadline = time.time() + timeout
-    while time.time() < deadline:
-        line = ser.readline().decode(errors='ignore').strip()
-        if line == expected:
-            return True
-    return False
-
-
-def send_data_via_serial(ser: serial.Serial, data: bytes, dest_name: str) -> bool:
-    """
-    Send header and data in chunks with handshakes:
-      - Header: "<dest_name>|<len>\n" → expect "READY"
-      - Each chunk → expect "ACK"
-      - Final → expect "DONE"
-    """
-    total_len = len(data)
-    header = f"{dest_name}|{total_len}\n"
-    ser.write(header.encode())
-    print(f"Sent header: '{header.strip()}'")
-
-    if not wait_for(ser, "READY", ACK_TIMEOUT):
-        print("Error: no READY from ESP32")
-        return False
-
-    sent = 0
-    while sent < total_len:
-        end = min(sent + CHUNK_SIZE, total_len)
-        ser.write(data[sent:end])
-        if not wait_for(ser, "ACK", ACK_TIMEOUT):
-            print(f"Error: no ACK for chunk at {sent}")
-            return False
-        sent = end
-        print(f"Sent {sent}/{total_len} bytes")
-
-    if not wait_for(ser, "DONE", ACK_TIMEOUT):
-        print("Error: no DONE from ESP32")
-        return False
-
-    print("Transfer completed successfully")
-    return True
-
 # --- Image Processing Functions ------------------------------------------
 
 def capture_raw_image() -> str:
@@ -148,11 +105,11 @@ def main():
     print("Ready. Awaiting 'foto' command...")
 
     while True:
-        line = ser.readline().decode(errors='ignore').strip()
+        line = read_line(ser)
         if not line:
             continue
-        parts = line.split()
-        if parts[0].lower() != 'foto':
+        parts = line.decode(errors='ignore').split()
+        if not parts or parts[0].lower() != 'foto':
             continue
 
         print("Received 'foto' command")
@@ -166,7 +123,7 @@ def main():
         buf = io.BytesIO()
         jpeg_quality = max(1, min(DEFAULT_QUALITY, 10)) * 10
         resized.save(buf, format='JPEG', quality=jpeg_quality, optimize=True)
-        data = buf.getvalue()
+        data = buf.getbuffer()  # memoryview over the encoder output, no copy
 
         # Send over serial
         dest_name = os.path.splitext(os.path.basename(enhanced_path))[0]
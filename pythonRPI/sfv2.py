@@ -8,11 +8,14 @@ When invoked, it:
  2. Resizes the image to a specified width and quality in memory.
  3. Sends the resized JPEG over UART using a chunked handshake:
     - SEND header: "<timestamp>|<size>\n" → expect "READY"
-    - For each chunk: send bytes → expect "ACK"
+    - For each chunk: send <seq><bytes><crc32> → expect "ACK" (up to WINDOW_SIZE
+      outstanding), "NAK" on CRC mismatch → resend from that chunk
     - After all chunks: expect "DONE"
+   With --spi the header ends in "|spi" and the bytes go over SPI instead,
+   one SPI_BLOCK per transaction, each acknowledged with "ACK" on UART.
 Added:
  - Debug output of selected serial port.
- - Filename sent over serial is only the timestamp.
+ - Filename sent over serial is only the capture id (timestamp + sequence).
  - After opening serial port, waits 1 s and sends "ready".
  - Saves both the raw full-resolution and the processed resized images to disk.
 """
@@ -21,20 +24,27 @@ import time
 import os
 import glob
 import sys
-import io
+import atexit
 from picamera2 import Picamera2
-from PIL import Image
-from datetime import datetime
+import numpy as np
+import cv2
+from camutil import archive, capture_id, tj, lores_size, lores_rgb
+from jpegenc import TJPF_RGB, TJPF_GRAY, TJSAMP_420, TJSAMP_GRAY
+from uartproto import (ACK_TIMEOUT, discard_input, enable_low_latency, read_line,
+                       send_data_via_serial, wait_for)
 import argparse
 
 # --- Configuration --------------------------------------------------------
-BAUD_RATE       = 115200
+BAUD_RATE       = 115200    # PL011 supports up to 921600; ESP32 FILE_UART_BAUD must match
 DEFAULT_WIDTH   = 1024
 DEFAULT_QUALITY = 5
-ACK_TIMEOUT     = 10      # seconds
-CHUNK_SIZE      = 256     # bytes per chunk
+GRAYSCALE_MAX   = 3       # quality scales up to this are sent as grayscale
 FULLRES_DIR     = 'fullres'
 PROCESSED_DIR   = 'processed'
+SPI_BUS         = 0
+SPI_DEVICE      = 0       # /dev/spidev0.0
+SPI_SPEED_HZ    = 8_000_000
+SPI_BLOCK       = 4092    # bytes per SPI transaction (ESP32 slave DMA buffer)
 
 # Ensure directories exist
 os.makedirs(FULLRES_DIR, exist_ok=True)
@@ -51,6 +61,18 @@ def unique_filename(base: str, ext: str, folder: str) -> str:
     return path
 
 
+def write_file(path: str, data: bytes) -> None:
+    """Write already-encoded bytes to `path`."""
+    with open(path, 'wb') as f:
+        f.write(data)
+    print(f"[INFO] Saved image: {path}")
+
+
+def save_jpeg(arr: np.ndarray, path: str, quality: int = 95) -> None:
+    """Encode an RGB array to JPEG and write it to `path`."""
+    write_file(path, tj.encode(arr, quality=quality, pixel_format=TJPF_RGB))
+
+
 def find_serial_port() -> str:
     """
     Detect available serial port: /dev/serial0, then /dev/ttyUSB*, then /dev/ttyACM*.
@@ -75,33 +97,28 @@ def find_serial_port() -> str:
     return None
 
 
-def wait_for(ser: serial.Serial, expected: str, timeout: int) -> bool:
-    """
-    Block until `expected` appears (line) on serial or timeout.
-    """
-    deadline = time.time() + timeout
-    ser.reset_input_buffer()
-    while time.time() < deadline:
-        try:
-            line = ser.readline().decode(errors='ignore').strip()
-        except Exception:
-            continue
-        if line:
-            print(f"[DEBUG] Received '{line}'")
-        if line == expected:
-            return True
-    return False
+def open_spi():
+    """Open the SPI bus used for bulk image data (needs python3-spidev)."""
+    import spidev
+    spi = spidev.SpiDev()
+    spi.open(SPI_BUS, SPI_DEVICE)
+    spi.max_speed_hz = SPI_SPEED_HZ
+    spi.mode = 0
+    print(f"[INFO] Opened SPI {SPI_BUS}.{SPI_DEVICE} at {SPI_SPEED_HZ} Hz")
+    return spi
 
 
-def send_data_via_serial(ser: serial.Serial, data: bytes, timestamp: str) -> bool:
+def send_data_via_spi(ser: serial.Serial, spi, data: bytes, timestamp: str) -> bool:
     """
-    Chunked transfer with handshake:
-      header: "<timestamp>|<len>\n" → READY
-      each CHUNK → ACK
+    Bulk transfer over SPI, control over UART:
+      header: "<timestamp>|<len>|spi\n" → READY
+      each SPI_BLOCK over SPI → ACK (ESP32 re-arms its DMA before answering);
+      the last block is zero-padded to a multiple of 4 bytes
       DONE at end
     """
     total = len(data)
-    header = f"{timestamp}|{total}\n"
+    header = f"{timestamp}|{total}|spi\n"
+    discard_input(ser)
     ser.write(header.encode())
     print(f"[DEBUG] Sent header: {header.strip()}")
 
@@ -109,15 +126,18 @@ def send_data_via_serial(ser: serial.Serial, data: bytes, timestamp: str) -> boo
         print("[ERROR] No READY")
         return False
 
-    offset = 0
-    while offset < total:
-        end = min(offset + CHUNK_SIZE, total)
-        ser.write(data[offset:end])
+    mv = memoryview(data)
+    for offset in range(0, total, SPI_BLOCK):
+        block = mv[offset:offset + SPI_BLOCK]
+        if len(block) % 4:
+            # The ESP32's DMA slave drops a tail that is not a multiple of 4 bytes;
+            # pad it (the sketch only writes fileSize bytes to SD)
+            block = bytes(block) + bytes(-len(block) % 4)
+        spi.writebytes2(block)
         if not wait_for(ser, 'ACK', ACK_TIMEOUT):
             print(f"[ERROR] No ACK at {offset}")
             return False
-        offset = end
-        print(f"[DEBUG] Sent {offset}/{total} bytes")
+        print(f"[DEBUG] Sent {min(offset + SPI_BLOCK, total)}/{total} bytes over SPI")
 
     if not wait_for(ser, 'DONE', ACK_TIMEOUT):
         print("[ERROR] No DONE")
@@ -127,49 +147,57 @@ def send_data_via_serial(ser: serial.Serial, data: bytes, timestamp: str) -> boo
     return True
 
 
-def capture_and_prepare(width: int, quality: int) -> (str, bytes):
+def capture_and_prepare(picam2: Picamera2, width: int, quality: int) -> (str, bytes):
     """
-    Capture full-resolution JPEG, save to disk, then resize & re-encode in memory.
+    Capture full-resolution frame in memory from the running camera, archive it in the background,
+    then resize & encode in memory. Each image is JPEG-encoded exactly once and
+    both disk writes happen on the archive thread.
     Returns (timestamp, jpeg_bytes).
     """
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    timestamp = capture_id()
     full_base = f"{timestamp}_fullres"
     full_path = unique_filename(full_base, 'jpg', FULLRES_DIR)
 
-    # Capture full-resolution
-    picam2 = Picamera2()
-    cfg = picam2.create_still_configuration(main={'size': picam2.sensor_resolution})
-    picam2.configure(cfg)
-    picam2.start()
-    time.sleep(2)
-    picam2.capture_file(full_path)
-    picam2.close()
+    # Capture full-resolution and ISP-scaled lores from the same frame
+    (arr, lores), _ = picam2.capture_arrays(['main', 'lores'])
+    archive(save_jpeg, arr, full_path)
     print(f"[INFO] Captured full-resolution image: {full_path}")
 
-    # Resize & encode
-    img = Image.open(full_path)
-    aspect = img.width / img.height if img.height else 1
-    new_height = max(1, int(width / aspect))
-    resized = img.resize((width, new_height), Image.LANCZOS)
-    buf = io.BytesIO()
+    # Resize & encode; the default width comes straight from the ISP unless
+    # libcamera adjusted the requested lores size
+    cfg = picam2.camera_config
+    if tuple(cfg['lores']['size']) == lores_size(cfg['main']['size'], width):
+        resized = lores_rgb(lores, cfg['lores'])
+        new_height = resized.shape[0]
+    else:
+        h, w = arr.shape[:2]
+        aspect = w / h if h else 1
+        new_height = max(1, int(width / aspect))
+        resized = cv2.resize(arr, (width, new_height), interpolation=cv2.INTER_LANCZOS4)
     q = max(1, min(quality, 10)) * 10
-    resized.save(buf, format='JPEG', quality=q, optimize=True)
-    size_bytes = buf.getbuffer().nbytes
-    print(f"[DEBUG] Prepared resize: {width}×{new_height}, quality={q}, {size_bytes} bytes")
-
-    # Save processed image
+    if q <= GRAYSCALE_MAX * 10:
+        # Low quality: drop chroma entirely, ~3x smaller over UART
+        gray = cv2.cvtColor(resized, cv2.COLOR_RGB2GRAY)
+        data = tj.encode(gray[..., None], quality=q,
+                         pixel_format=TJPF_GRAY, jpeg_subsample=TJSAMP_GRAY)
+    else:
+        data = tj.encode(resized, quality=q,
+                         pixel_format=TJPF_RGB, jpeg_subsample=TJSAMP_420)
+    print(f"[DEBUG] Prepared resize: {width}×{new_height}, quality={q}, {len(data)} bytes")
+
+    # Save processed image: the same immutable bytes go to disk and to the UART
     proc_path = unique_filename(timestamp, 'jpg', PROCESSED_DIR)
-    with open(proc_path, 'wb') as f:
-        f.write(buf.getvalue())
-    print(f"[INFO] Saved processed image: {proc_path}")
+    archive(write_file, proc_path, data)
 
-    return timestamp, buf.getvalue()
+    return timestamp, data
 
 # --- Main Loop -----------------------------------------------------------
 def main():
     parser = argparse.ArgumentParser(description='Capture and send JPEG via UART')
     parser.add_argument('--port', help='Serial port override', default=None)
     parser.add_argument('--baud', help='Baud rate', type=int, default=BAUD_RATE)
+    parser.add_argument('--rtscts', help='Enable RTS/CTS hardware flow control', action='store_true')
+    parser.add_argument('--spi', help='Send image data over SPI (control stays on UART)', action='store_true')
     args = parser.parse_args()
 
     port = args.port or find_serial_port()
@@ -177,10 +205,25 @@ def main():
         sys.exit(1)
 
     try:
-        ser = serial.Serial(port, args.baud, timeout=1)
+        ser = serial.Serial(port, args.baud, timeout=1, rtscts=args.rtscts)
+        enable_low_latency(ser)
         ser.reset_input_buffer(); ser.reset_output_buffer()
         print(f"[INFO] Opened serial port {port} at {args.baud} baud")
 
+        # Initialize camera once; it stays running between commands
+        picam2 = Picamera2()
+        sensor_res = picam2.sensor_resolution
+        cfg = picam2.create_still_configuration(
+            main={'size': sensor_res},
+            lores={'size': lores_size(sensor_res, DEFAULT_WIDTH), 'format': 'YUV420'})
+        picam2.configure(cfg)
+        picam2.start()
+        atexit.register(picam2.close)
+        time.sleep(2)
+        print("[INFO] Camera started")
+
+        spi = open_spi() if args.spi else None
+
         # Notify ready after opening
         time.sleep(1)
         ser.write(b"ready\n")
@@ -189,11 +232,12 @@ def main():
         print(f"[INFO] Listening on {port}@{args.baud}, awaiting 'foto'...")
 
         while True:
-            line = ser.readline().decode(errors='ignore').strip()
+            line = read_line(ser)
             if not line:
                 continue
+            line = line.decode(errors='ignore')
             parts = line.split()
-            if parts[0].lower() != 'foto':
+            if not parts or parts[0].lower() != 'foto':
                 print(f"[WARN] Unknown cmd: '{line}'")
                 continue
 
@@ -212,9 +256,13 @@ def main():
                     print(f"[WARN] Invalid quality '{parts[2]}'; using {DEFAULT_QUALITY}")
 
             print(f"[INFO] Command: foto → width={w}, quality={q}")
-            timestamp, data = capture_and_prepare(w, q)
+            timestamp, data = capture_and_prepare(picam2, w, q)
 
-            if not send_data_via_serial(ser, data, timestamp):
+            if spi:
+                ok = send_data_via_spi(ser, spi, data, timestamp)
+            else:
+                ok = send_data_via_serial(ser, data, timestamp)
+            if not ok:
                 print("[ERROR] Transfer failed.")
             else:
                 print(f"[INFO] Sent as: {timestamp}.jpg")
@@ -226,6 +274,8 @@ def main():
     finally:
         if 'ser' in locals() and ser.is_open:
             ser.close()
+        if 'spi' in locals() and spi:
+            spi.close()
 
 if __name__ == '__main__':
     main()
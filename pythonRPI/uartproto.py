@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+UART transfer protocol (Pi side)
+--------------------------------
+The chunked handshake shared by every capture script that sends images to the
+ESP32 (Unified_SIM7600_SD_Image_Manager.ino):
+
+  - Header "<name>|<size>\n" → expect "READY"
+  - Frames <seq u16 LE><chunk><crc32 u32 LE>, CHUNK_SIZE bytes of data each,
+    up to WINDOW_SIZE awaiting "ACK" at once
+  - "NAK" (bad CRC, out-of-order seq or truncated frame) → the ESP32 drops
+    input until the line is idle; wait RESYNC_PAUSE, discard stale replies and
+    resend from the first unacknowledged chunk, so the resent frames start on
+    a frame boundary
+  - After the last chunk → expect "DONE"
+
+CHUNK_SIZE and WINDOW_SIZE must match the sketch's CHUNK_SIZE and FILE_WINDOW,
+and RESYNC_PAUSE must be longer than its RESYNC_IDLE_MS.
+"""
+import serial
+import struct
+import time
+import zlib
+
+CHUNK_SIZE   = 2048   # bytes per chunk (matches ESP32 CHUNK_SIZE)
+WINDOW_SIZE  = 4      # chunks in flight before waiting for ACKs (matches ESP32 FILE_WINDOW)
+ACK_TIMEOUT  = 10     # seconds to wait per handshake
+RESYNC_PAUSE = 0.2    # seconds of silence after a NAK (ESP32 RESYNC_IDLE_MS is 50 ms)
+
+# Bytes received on serial that have not yet formed a complete line
+_rx_buf = bytearray()
+
+# Reusable send buffer for one <seq><chunk><crc32> frame
+_frame = bytearray(2 + CHUNK_SIZE + 4)
+
+
+def enable_low_latency(ser: serial.Serial) -> None:
+    """Ask the kernel driver to push received bytes immediately (ASYNC_LOW_LATENCY)."""
+    try:
+        ser.set_low_latency_mode(True)
+    except (AttributeError, OSError, ValueError) as e:
+        print(f"Low-latency mode not available on this port: {e}")
+
+
+def discard_input(ser: serial.Serial) -> None:
+    """Drop everything received so far, including a buffered partial line."""
+    ser.reset_input_buffer()
+    _rx_buf.clear()
+
+
+def read_line(ser: serial.Serial):
+    """
+    Return the next complete line from serial (stripped bytes), or None.
+    Reads everything already waiting in one call and buffers partial lines.
+    """
+    idx = _rx_buf.find(b'\n')
+    if idx < 0:
+        _rx_buf.extend(ser.read(ser.in_waiting or 1))
+        idx = _rx_buf.find(b'\n')
+        if idx < 0:
+            return None
+    line = bytes(_rx_buf[:idx]).strip()
+    del _rx_buf[:idx + 1]
+    return line
+
+
+def wait_for(ser: serial.Serial, expected: str, timeout: int) -> bool:
+    """Block until `expected` line arrives on serial or timeout."""
+    token = expected.encode()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if read_line(ser) == token:
+            return True
+    return False
+
+
+def write_frame(ser: serial.Serial, seq: int, chunk) -> None:
+    """
+    Write one chunk framed as <seq u16 LE><chunk><crc32 u32 LE>; the CRC covers seq + chunk.
+    The frame is assembled in the preallocated _frame buffer and sent with a single write.
+    """
+    n = len(chunk)
+    view = memoryview(_frame)
+    struct.pack_into('<H', _frame, 0, seq)
+    _frame[2:2 + n] = chunk
+    struct.pack_into('<I', _frame, 2 + n, zlib.crc32(view[:2 + n]))
+    ser.write(view[:n + 6])
+
+
+def send_data_via_serial(ser: serial.Serial, data: bytes, dest_name: str) -> bool:
+    """
+    Send header and data in chunks with handshakes:
+      - Header: "<dest_name>|<len>\n" → expect "READY"
+      - Each CRC32-framed chunk → expect "ACK" (up to WINDOW_SIZE outstanding),
+        "NAK" → pause, then resend from that chunk
+      - Final → expect "DONE"
+    Returns True on success.
+    """
+    total_len = len(data)
+    header = f"{dest_name}|{total_len}\n"
+    discard_input(ser)
+    ser.write(header.encode())
+    print(f"Sent header: '{header.strip()}'")
+
+    if not wait_for(ser, "READY", ACK_TIMEOUT):
+        print("Error: no READY from ESP32")
+        return False
+
+    mv = memoryview(data)  # zero-copy chunk slices
+    n_chunks = (total_len + CHUNK_SIZE - 1) // CHUNK_SIZE
+    sent = acked = 0
+    done = False
+    deadline = time.time() + ACK_TIMEOUT
+    while acked < n_chunks or not done:
+        while sent < n_chunks and sent - acked < WINDOW_SIZE:
+            offset = sent * CHUNK_SIZE
+            write_frame(ser, sent, mv[offset:offset + CHUNK_SIZE])
+            sent += 1
+
+        line = read_line(ser)
+        if line == b'ACK':
+            acked += 1
+            deadline = time.time() + ACK_TIMEOUT
+            print(f"Sent {min(acked * CHUNK_SIZE, total_len)}/{total_len} bytes")
+        elif line == b'NAK':
+            # Frame error at the next expected chunk. Let the frames already
+            # queued go out and the line fall idle so the ESP32 can resync,
+            # then resend from there
+            print(f"Frame error at chunk {acked}, resending")
+            ser.flush()
+            time.sleep(RESYNC_PAUSE)
+            discard_input(ser)
+            sent = acked
+            deadline = time.time() + ACK_TIMEOUT
+        elif line == b'DONE':
+            # The ESP32 only sends DONE once every chunk is on SD, so it also
+            # covers any ACK lost or garbled on the way back
+            done = True
+            acked = n_chunks
+
+        if time.time() > deadline:
+            if acked < n_chunks:
+                print(f"Error: no ACK for chunk at {acked * CHUNK_SIZE}")
+            else:
+                print("Error: no DONE from ESP32")
+            return False
+
+    print("Transfer completed successfully")
+    return True